@@ -0,0 +1,33 @@
+"""Optional just-in-time compilation of the atlas_commons kernels
+
+numba is an optional dependency, see the `numba` extra of setup.py. If numba cannot be imported,
+`njit` returns the decorated function unchanged, `prange` is `range` and `HAVE_NUMBA` is False.
+Callers should then use their numpy implementations rather than the interpreted kernels.
+
+The kernels release the GIL, and those looping over voxels or vectors run on all the cores. The
+number of threads is controlled by the NUMBA_NUM_THREADS environment variable, or by
+`numba.set_num_threads`; it is never set by atlas_commons.
+
+The parallel kernels can be called concurrently from several Python threads only with a
+thread-safe threading layer of numba, i.e., tbb or omp, which can be required with
+NUMBA_THREADING_LAYER=threadsafe. numba falls back to its workqueue layer if neither is available,
+and this layer aborts the process on concurrent calls.
+
+With numba installed, NUMBA_DISABLE_JIT=1 makes numba run the kernels as Python code, e.g., to
+measure their test coverage.
+"""
+# pylint: disable=invalid-name,unused-import
+
+try:
+    from numba import njit, prange
+
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+    prange = range  # type: ignore[misc]
+
+    def njit(*args, **kwargs):  # type: ignore[no-redef] # pylint: disable=unused-argument
+        """No-op replacement of numba.njit, with or without arguments"""
+        if len(args) == 1 and not kwargs and callable(args[0]):
+            return args[0]
+        return lambda function: function
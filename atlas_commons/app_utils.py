@@ -2,7 +2,7 @@
 import inspect
 import logging
 import os
-from collections.abc import Iterable, Mapping
+from collections.abc import Mapping
 from datetime import datetime
 from functools import wraps
 from pathlib import Path
@@ -27,21 +27,35 @@ class ParameterContainer(dict):
         return ", ".join(str(key) + ":" + str(val) for key, val in self.items())
 
 
+def _add_file_handler(logger, logger_path):
+    """Add a file handler writing to logger_path unless logger already has one"""
+    logger_path = os.path.abspath(logger_path)
+    if not any(
+        isinstance(handler, logging.FileHandler) and handler.baseFilename == logger_path
+        for handler in logger.handlers
+    ):
+        logger.addHandler(logging.FileHandler(logger_path))
+
+
 def log_args(logger):
     """A decorator used to redirect logger and log arguments"""
 
     def set_logger(function):
+        # Built once: parameters which are not passed are displayed with their signature.
+        template = ParameterContainer(inspect.signature(function).parameters)
+        names = tuple(template)
+
         @wraps(function)
         def wrapper(*args, **kw):
             logger_path = os.path.join(LOG_DIRECTORY, function.__name__ + ".log")
-            logger.addHandler(logging.FileHandler(logger_path))
-            param = ParameterContainer(inspect.signature(function).parameters)
-            for name, arg in zip(inspect.signature(function).parameters, args):
-                param[name] = arg
-            for key, value in kw.items():
-                param[key] = value
-            date_str = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-            logger.info(f"{date_str}:{function.__name__} args:[{param}]")
+            # The handler is added when calling because LOG_DIRECTORY can be set by a CLI option.
+            _add_file_handler(logger, logger_path)
+            if logger.isEnabledFor(logging.INFO):
+                param = ParameterContainer(template)
+                param.update(zip(names, args))
+                param.update(kw)
+                date_str = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
+                logger.info(f"{date_str}:{function.__name__} args:[{param}]")
             function(*args, **kw)
 
         return wrapper
@@ -55,8 +69,19 @@ def log_args(logger):
 
 
 def ensure_list(value):
-    """Convert iterable / wrap scalar into list (strings are considered scalar)."""
-    if isinstance(value, Iterable) and not isinstance(value, (str, Mapping)):
+    """Convert iterable / wrap scalar into list (strings are considered scalar).
+
+    Lists are returned as is.
+    """
+    # Exact type checks first: the ABC check of isinstance(value, Iterable) is comparatively slow.
+    value_type = type(value)
+    if value_type is list:
+        return value
+    if value_type is tuple:
+        return list(value)
+    if isinstance(value, (str, Mapping)):
+        return [value]
+    if hasattr(value, "__iter__"):
         return list(value)
     return [value]
 
@@ -74,6 +99,44 @@ def compare_all(data_sets, fun, comp):
     return res
 
 
+def _stack_properties(values, name):
+    """Stack into a single array the values of the property `name`
+
+    Raises:
+        AtlasCommonsError if the values cannot be stacked, e.g., arrays of different lengths.
+    """
+    try:
+        return np.stack(values)
+    except ValueError as error_:
+        raise AtlasCommonsError(f"Need to have the same {name} for all files") from error_
+
+
+def _assert_same_properties(atlases, shape_fun):
+    """Assert that the shapes extracted using shape_fun, voxel_dimensions and offset match
+
+    Properties are collected in a single pass over the atlases, one sequence per property.
+    Shapes are integer tuples and are compared exactly. voxel_dimensions and offset are stacked
+    so that all atlases are compared to the first one by a single broadcast comparison.
+    """
+    if len(atlases) < 2:  # nothing to compare
+        return
+
+    shapes, voxel_dimensions, offsets = [], [], []
+    for atlas in atlases:
+        shapes.append(tuple(shape_fun(atlas)))
+        voxel_dimensions.append(atlas.voxel_dimensions)
+        offsets.append(atlas.offset)
+
+    if any(shape != shapes[0] for shape in shapes[1:]):
+        raise AtlasCommonsError("Need to have the same shape for all files")
+    voxel_dimensions = _stack_properties(voxel_dimensions, "voxel_dimensions")
+    if not np.allclose(voxel_dimensions, voxel_dimensions[0]):
+        raise AtlasCommonsError("Need to have the same voxel_dimensions for all files")
+    offsets = _stack_properties(offsets, "offset")
+    if not np.allclose(offsets, offsets[0]):
+        raise AtlasCommonsError("Need to have the same offset for all files")
+
+
 def assert_properties(atlases):
     """Assert that all atlases properties match
 
@@ -83,13 +146,7 @@ def assert_properties(atlases):
     Raises:
         if one of the property is not shared by all data files
     """
-    atlases = ensure_list(atlases)
-    if not compare_all(atlases, lambda x: x.raw.shape, comp=np.allclose):
-        raise AtlasCommonsError("Need to have the same shape for all files")
-    if not compare_all(atlases, lambda x: x.voxel_dimensions, comp=np.allclose):
-        raise AtlasCommonsError("Need to have the same voxel_dimensions for all files")
-    if not compare_all(atlases, lambda x: x.offset, comp=np.allclose):
-        raise AtlasCommonsError("Need to have the same offset for all files")
+    _assert_same_properties(ensure_list(atlases), lambda x: x.raw.shape)
 
 
 def assert_meta_properties(atlases):
@@ -111,13 +168,58 @@ def assert_meta_properties(atlases):
     Raises:
         if one of the above meta properties is not shared by all VoxelData objects.
     """
-    atlases = ensure_list(atlases)
-    if not compare_all(atlases, lambda x: x.shape, comp=np.allclose):
-        raise AtlasCommonsError("Need to have the same shape for all files")
-    if not compare_all(atlases, lambda x: x.voxel_dimensions, comp=np.allclose):
-        raise AtlasCommonsError("Need to have the same voxel_dimensions for all files")
-    if not compare_all(atlases, lambda x: x.offset, comp=np.allclose):
-        raise AtlasCommonsError("Need to have the same offset for all files")
+    _assert_same_properties(ensure_list(atlases), lambda x: x.shape)
+
+
+def _set_log_directory(_, __, log_output_path):
+    global LOG_DIRECTORY  # pylint: disable=global-statement
+    LOG_DIRECTORY = log_output_path
+
+
+# Options shared by the atlas CLIs. They are built once and attached to each decorated command.
+_ANNOTATION_PATH_OPTION = click.Option(
+    ["--annotation-path"],
+    type=EXISTING_FILE_PATH,
+    required=True,
+    help=(
+        "The path to the whole mouse brain annotation file (nrrd). See the main command "
+        "description for possible restrictions."
+    ),
+)
+_HIERARCHY_PATH_OPTION = click.Option(
+    ["--hierarchy-path"],
+    type=EXISTING_FILE_PATH,
+    required=True,
+    help="The path to the hierarchy file, i.e., AIBS 1.json or BBP hierarchy.json.",
+)
+_VERBOSE_OPTION = click.Option(
+    ["-v", "--verbose"],
+    count=True,
+    required=False,
+    help="Use -v for info and -vv for debug. Defaults to warning level.",
+)
+_LOG_OUTPUT_PATH_OPTION = click.Option(
+    ["--log-output-path"],
+    type=click.Path(writable=True, file_okay=False, dir_okay=True, resolve_path=True),
+    default=LOG_DIRECTORY,
+    required=False,
+    help="Set the log directory",
+    callback=_set_log_directory,
+    is_eager=True,
+    expose_value=False,
+)
+
+
+def _add_options(function, options):
+    """Attach options to function as successive click.option decorators would do"""
+    if isinstance(function, click.Command):
+        function.params.extend(options)
+    else:
+        if not hasattr(function, "__click_params__"):
+            function.__click_params__ = []
+        function.__click_params__.extend(options)
+
+    return function
 
 
 def common_atlas_options(function):
@@ -136,23 +238,7 @@ def common_atlas_options(function):
             ...
             def combine_annotations(annotation_path, hierarchy_path, ...):
     """
-    function = click.option(
-        "--annotation-path",
-        type=EXISTING_FILE_PATH,
-        required=True,
-        help=(
-            "The path to the whole mouse brain annotation file (nrrd). See the main command "
-            "description for possible restrictions."
-        ),
-    )(function)
-    function = click.option(
-        "--hierarchy-path",
-        type=EXISTING_FILE_PATH,
-        required=True,
-        help="The path to the hierarchy file, i.e., AIBS 1.json or BBP hierarchy.json.",
-    )(function)
-
-    return function
+    return _add_options(function, [_ANNOTATION_PATH_OPTION, _HIERARCHY_PATH_OPTION])
 
 
 def set_verbose(logger, verbose):
@@ -179,27 +265,4 @@ def verbose_option(function):
             def combine_annotations(verbose, ...):
                 set_verbose(L, verbose)
     """
-    function = click.option(
-        "-v",
-        "--verbose",
-        count=True,
-        required=False,
-        help="Use -v for info and -vv for debug. Defaults to warning level.",
-    )(function)
-
-    def set_log_file(_, __, log_output_path):
-        global LOG_DIRECTORY  # pylint: disable=global-statement
-        LOG_DIRECTORY = log_output_path
-
-    function = click.option(
-        "--log-output-path",
-        type=click.Path(writable=True, file_okay=False, dir_okay=True, resolve_path=True),
-        default=LOG_DIRECTORY,
-        required=False,
-        help="Set the log directory",
-        callback=set_log_file,
-        is_eager=True,
-        expose_value=False,
-    )(function)
-
-    return function
+    return _add_options(function, [_VERBOSE_OPTION, _LOG_OUTPUT_PATH_OPTION])
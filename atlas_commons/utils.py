@@ -1,14 +1,276 @@
 """Generic atlas tools"""
 from __future__ import annotations
 
-from typing import Dict, Tuple
+import math
+import re
+import weakref
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, cast
 
 import numpy as np
-import voxcell
 
+from atlas_commons._jit import HAVE_NUMBA, njit, prange
 from atlas_commons.exceptions import AtlasCommonsError
 from atlas_commons.typing import AnnotationT, BoolArray, FloatArray, NumericArray
 
+if TYPE_CHECKING:
+    # voxcell is slow to import and is not needed at run time
+    import voxcell
+
+# Results of RegionMap.find and region tables, cached per RegionMap object.
+# Entries are dropped together with the RegionMap objects they refer to.
+_FIND_CACHE: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_FRAME_CACHE: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _region_frame(region_map: voxcell.RegionMap):
+    """Cached `region_map.as_dataframe()`, sorted by region id."""
+    if region_map not in _FRAME_CACHE:
+        _FRAME_CACHE[region_map] = region_map.as_dataframe().sort_index()
+
+    return _FRAME_CACHE[region_map]
+
+
+def _find(
+    region_map: voxcell.RegionMap, query, attribute: str, with_descendants: bool = False
+) -> np.ndarray:
+    """
+    Cached version of `region_map.find(query, attribute, with_descendants=with_descendants)`.
+
+    The hierarchy is walked, and the ids converted into an array, only at the first call with a
+    given query. RegionMap objects are assumed not to be modified once queried.
+
+    Returns:
+        read-only int64 array of the unique ids returned by `RegionMap.find`.
+    """
+    cache = _FIND_CACHE.setdefault(region_map, {})
+    key = (query, attribute, with_descendants)
+    if key not in cache:
+        found = region_map.find(query, attribute, with_descendants=with_descendants)
+        ids = np.fromiter(found, dtype=np.int64, count=len(found))
+        ids.setflags(write=False)  # the array is shared by all the callers
+        cache[key] = ids
+
+    return cache[key]
+
+
+# Flags of the regexes without inline flags, and inline flag groups which apply to a whole regex
+_DEFAULT_REGEX_FLAGS = re.compile("").flags
+_GLOBAL_INLINE_FLAGS = re.compile(r"\(\?[aiLmsux]+\)")
+
+
+def _match_regexes(
+    region_map: voxcell.RegionMap, queries: List[str], attribute: str
+) -> Optional[List[np.ndarray]]:
+    """
+    Get the ids of the regions whose `attribute` matches each of the regex `queries`.
+
+    The regexes are combined into a single alternation which rejects most of the regions with one
+    search, in one pass over the regions. Only the regions matched by the alternation are tested
+    against each regex.
+
+    Returns:
+        list of the sorted int64 arrays of the matching ids, in the order of `queries`, or None if
+        the regexes cannot be combined, or if some values of `attribute` are not strings.
+    """
+    patterns = [re.compile(query[1:]) for query in queries]
+    if any(pattern.groups for pattern in patterns):
+        return None  # back-references would be shifted by the alternation
+    if any(
+        pattern.flags != _DEFAULT_REGEX_FLAGS or _GLOBAL_INLINE_FLAGS.search(pattern.pattern)
+        for pattern in patterns
+    ):
+        # Before Python 3.11, global inline flags in the middle of the alternation do not raise
+        # an error but apply to all the regexes.
+        return None
+    try:
+        combined = re.compile("|".join(f"(?:{pattern.pattern})" for pattern in patterns))
+    except re.error:  # e.g., global inline flags in the middle of the alternation
+        return None
+
+    frame = _region_frame(region_map)
+    if attribute not in frame.columns:
+        return None
+    values = frame[attribute].tolist()
+    if not all(isinstance(value, str) for value in values):
+        return None
+
+    matches: List[List[int]] = [[] for _ in patterns]
+    for id_, value in zip(frame.index.tolist(), values):
+        if combined.search(value) is not None:
+            for pattern, ids in zip(patterns, matches):
+                if pattern.search(value) is not None:
+                    ids.append(id_)
+
+    return [np.array(ids, dtype=np.int64) for ids in matches]
+
+
+def _find_all(
+    region_map: voxcell.RegionMap, queries: list, attribute: str, with_descendants: bool = False
+) -> List[np.ndarray]:
+    """
+    Cached version of `region_map.find` applied to each of `queries`.
+
+    Without descendants, the regex queries which are not cached yet are matched together, in a
+    single pass over the hierarchy, instead of one pass per query. With descendants, the queries
+    are passed to `RegionMap.find`, which collects the descendants.
+
+    Returns:
+        list of the read-only int64 arrays of the ids found, in the order of `queries`.
+    """
+    cache = _FIND_CACHE.setdefault(region_map, {})
+    pending = [
+        query
+        for query in dict.fromkeys(queries)
+        if isinstance(query, str)
+        and query.startswith("@")
+        and (query, attribute, False) not in cache
+    ]
+    if len(pending) > 1 and not with_descendants:
+        matches = _match_regexes(region_map, pending, attribute)
+        for query, ids in zip(pending, matches or []):
+            ids.setflags(write=False)
+            cache[(query, attribute, False)] = ids
+
+    return [_find(region_map, query, attribute, with_descendants) for query in queries]
+
+
+# Below this number of ids, successive equality tests are faster than np.isin, whose sort-based
+# implementation has a significant constant cost.
+_MAX_IDS_FOR_EQUALITY_TESTS = 8
+
+# Below this number of ids, a region mask is made of a few equality tests rather than gathered from
+# a lookup table, which needs an additional pass over the annotation to compute its size.
+_MIN_IDS_FOR_LOOKUP_TABLE = 5
+
+
+def _isin(annotation: AnnotationT, ids: np.ndarray) -> BoolArray:
+    """
+    Create the mask of the voxels of `annotation` whose labels are in `ids`.
+
+    This is the implementation used for annotations which cannot index a lookup table.
+    """
+    if ids.size >= _MAX_IDS_FOR_EQUALITY_TESTS:
+        return np.isin(annotation, ids)
+
+    mask = np.zeros(annotation.shape, dtype=bool)
+    equal = np.empty_like(mask)
+    for id_ in ids:
+        np.equal(annotation, id_, out=equal)
+        mask |= equal
+
+    return mask
+
+
+def _lookup_table_size(annotation: AnnotationT) -> Optional[int]:
+    """
+    Return the size of a lookup table which can be indexed by the labels of `annotation`.
+
+    Args:
+        annotation: array of region ids.
+
+    Returns:
+        1 + the maximum label of `annotation`, or None if `annotation` is not of integer type
+        or has negative labels, in which case it cannot be used to index a lookup table.
+    """
+    if annotation.dtype.kind not in "ui":
+        return None
+    if annotation.size == 0:
+        return 1
+    if annotation.dtype.kind == "i" and annotation.min() < 0:
+        return None
+
+    return int(annotation.max()) + 1
+
+
+def _lookup_table_indices(ids: np.ndarray, size: int) -> np.ndarray:
+    """
+    Return the region ids which can be used as indices of a lookup table of size `size`.
+
+    Ids which cannot be found in an annotation whose lookup table has size `size` are skipped.
+    """
+    return ids[(ids >= 0) & (ids < size)]
+
+
+# The kernels are compiled lazily, and cached on disk, for the types actually met: eager signatures
+# would compile or load all of them, for every pair of annotation and lookup table types, when the
+# module is imported.
+@njit(parallel=True, nogil=True, cache=True, boundscheck=False)
+def _apply_lookup_table_kernel(labels, lut, out):
+    """
+    Write in `out` the values of `lut` indexed by `labels`, two 1D arrays of the same size.
+
+    Labels are assumed to be valid indices of `lut`.
+    """
+    for i in prange(labels.size):  # pylint: disable=not-an-iterable
+        out[i] = lut[labels[i]]
+
+
+def _apply_lookup_table(lut: np.ndarray, annotation: AnnotationT) -> np.ndarray:
+    """
+    Gather the values of `lut` indexed by the labels of `annotation` into a new array.
+
+    Args:
+        lut: 1D lookup table whose size is given by `_lookup_table_size(annotation)`.
+        annotation: array of region ids.
+
+    Returns:
+        array of the shape of `annotation` and of the type of `lut`.
+    """
+    if not HAVE_NUMBA or not annotation.dtype.isnative:
+        # Faster than lut[annotation], which goes through the generic fancy indexing machinery.
+        # The kernel cannot read non-native byte orders, e.g., big-endian annotations of pynrrd.
+        return lut.take(annotation)
+
+    out = np.empty(annotation.shape, dtype=lut.dtype)
+    _apply_lookup_table_kernel(annotation.ravel(), lut, out.reshape(-1))
+
+    return out
+
+
+# Number of entries above which boolean lookup tables are bit-packed (8 entries per byte) so
+# that they stay cache-resident while being gathered.
+_MAX_DENSE_MASK_LOOKUP_TABLE_SIZE = 1 << 20
+
+
+@njit(parallel=True, nogil=True, cache=True, boundscheck=False)
+def _apply_bit_lookup_table_kernel(labels, bits, out):
+    """
+    Write in `out` the bits of `bits` indexed by `labels`, two 1D arrays of the same size.
+
+    The bit of index `label` is the bit `label & 7` of the byte `label >> 3` in little endian order.
+    Labels are assumed to be valid bit indices.
+    """
+    for i in prange(labels.size):  # pylint: disable=not-an-iterable
+        label = labels[i]
+        out[i] = (bits[label >> 3] >> (label & 7)) & 1 != 0
+
+
+def _gather_region_mask(ids: np.ndarray, size: int, annotation: AnnotationT) -> BoolArray:
+    """
+    Create the mask of the voxels of `annotation` whose labels are in `ids`, using a lookup table.
+
+    Large lookup tables, e.g., for annotations with sparse ids of 10^7 magnitude, are bit-packed
+    if numba is available. The bits are set directly from the ids, so that the dense boolean table
+    is never allocated.
+
+    Args:
+        ids: array of region ids.
+        size: size of the lookup table, given by `_lookup_table_size(annotation)`.
+        annotation: array of region ids.
+    """
+    indices = _lookup_table_indices(ids, size)
+    if not HAVE_NUMBA or not annotation.dtype.isnative or size <= _MAX_DENSE_MASK_LOOKUP_TABLE_SIZE:
+        lut = np.zeros(size, dtype=bool)
+        lut[indices] = True
+        return _apply_lookup_table(lut, annotation)
+
+    out = np.empty(annotation.shape, dtype=bool)
+    bits = np.zeros((size + 7) // 8, dtype=np.uint8)
+    np.bitwise_or.at(bits, indices >> 3, np.left_shift(1, indices & 7).astype(np.uint8))
+    _apply_bit_lookup_table_kernel(annotation.ravel(), bits, out.reshape(-1))
+
+    return out
+
 
 def query_region_mask(
     region: dict, annotation: AnnotationT, region_map: voxcell.RegionMap
@@ -31,11 +293,17 @@ def query_region_mask(
     Returns:
        3D boolean array of the same shape as annotation.
     """
-    ids = region_map.find(
-        region["query"], region["attribute"], with_descendants=region.get("with_descendants", False)
+    ids = _find(
+        region_map,
+        region["query"],
+        region["attribute"],
+        with_descendants=region.get("with_descendants", False),
     )
+    size = _lookup_table_size(annotation) if ids.size >= _MIN_IDS_FOR_LOOKUP_TABLE else None
+    if size is None:
+        return _isin(annotation, ids)
 
-    return np.isin(annotation, list(ids))
+    return _gather_region_mask(ids, size, annotation)
 
 
 def get_region_mask(
@@ -85,10 +353,12 @@ def split_into_halves(
     """
     if z_halfway == 0:
         z_halfway = compute_halfway(volume.shape[2])
-    left_volume = volume.copy()
-    left_volume[..., z_halfway:] = 0
-    right_volume = volume.copy()
-    right_volume[..., :z_halfway] = 0
+    # Only the kept half of each output is copied; the other half is left to zero. Unlike
+    # np.zeros_like, which fills its output, np.zeros gets zeroed memory from the allocator.
+    left_volume = cast("NumericArray", np.zeros(volume.shape, dtype=volume.dtype))
+    np.copyto(left_volume[..., :z_halfway], volume[..., :z_halfway])
+    right_volume = cast("NumericArray", np.zeros(volume.shape, dtype=volume.dtype))
+    np.copyto(right_volume[..., z_halfway:], volume[..., z_halfway:])
 
     return left_volume, right_volume
 
@@ -116,6 +386,24 @@ def assign_hemispheres(annotation, z_halfway: int = 0):
     return hemispheres
 
 
+def _describe_keys(keys: Tuple[str, ...]) -> str:
+    """Return a human-readable enumeration of keys, e.g., '"names", "queries" and "attribute"'"""
+    quoted = [f'"{key}"' for key in keys]
+
+    return ", ".join(quoted[:-1]) + " and " + quoted[-1]
+
+
+# Mandatory keys of the sub-dictionaries of the metadata, with their descriptions for error
+# messages, see `assert_metadata_content`. Descriptions are formatted once for all calls.
+_METADATA_MANDATORY_KEYS = tuple(
+    (key, mandatory_keys, _describe_keys(mandatory_keys))
+    for (key, mandatory_keys) in (
+        ("region", ("name", "query", "attribute")),
+        ("layers", ("names", "queries", "attribute")),
+    )
+)
+
+
 def assert_metadata_content(metadata: dict) -> None:
     """
     Raise an error if some mandatory key is missing in `metadata`.
@@ -142,34 +430,18 @@ def assert_metadata_content(metadata: dict) -> None:
         layer names and queries are different.
     """
 
-    if "region" not in metadata:
-        raise AtlasCommonsError('Missing "region" key')
-
-    metadata_region = metadata["region"]
-
-    missing = {"name", "query", "attribute"} - set(metadata_region.keys())
-    if missing:
-        err_msg = (
-            'The "region" dictionary has the following mandatory keys: '
-            '"name", "query" and "attribute".'
-            f" Missing: {missing}."
-        )
-        raise AtlasCommonsError(err_msg)
-
-    if "layers" not in metadata:
-        raise AtlasCommonsError('Missing "layers" key')
+    for (key, mandatory_keys, keys_description) in _METADATA_MANDATORY_KEYS:
+        if key not in metadata:
+            raise AtlasCommonsError(f'Missing "{key}" key')
+        missing = set(mandatory_keys) - set(metadata[key].keys())
+        if missing:
+            err_msg = (
+                f'The "{key}" dictionary has the following mandatory keys: '
+                f"{keys_description}. Missing: {missing}."
+            )
+            raise AtlasCommonsError(err_msg)
 
     metadata_layers = metadata["layers"]
-
-    missing = {"names", "queries", "attribute"} - set(metadata_layers.keys())
-    if missing:
-        err_msg = (
-            'The "layers" dictionary has the following mandatory keys: '
-            '"names", "queries" and "attribute".'
-            f" Missing: {missing}."
-        )
-        raise AtlasCommonsError(err_msg)
-
     if not (
         isinstance(metadata_layers["names"], list)
         and isinstance(metadata_layers["queries"], list)
@@ -180,6 +452,84 @@ def assert_metadata_content(metadata: dict) -> None:
         )
 
 
+def _get_layers_ids(region_map: voxcell.RegionMap, metadata: dict) -> List[np.ndarray]:
+    """
+    Get the ids of each layer in `metadata`, restricted to the region of `metadata`.
+
+    Args:
+        region_map: RegionMap object used to navigate the brain regions hierarchy.
+        metadata: dict, see :fun:`atlas_commons.utils.assert_metadata`.
+
+    Returns:
+        list of the arrays of region ids of the layers, in the order of `metadata`.
+    """
+    metadata_layers = metadata["layers"]
+    region_ids = _find(
+        region_map,
+        metadata["region"]["query"],
+        metadata["region"]["attribute"],
+        with_descendants=metadata["region"].get("with_descendants", False),
+    )
+
+    return [
+        np.intersect1d(ids, region_ids, assume_unique=True)
+        for ids in _find_all(
+            region_map,
+            metadata_layers["queries"],
+            metadata_layers["attribute"],
+            with_descendants=metadata_layers.get("with_descendants", False),
+        )
+    ]
+
+
+def _layers_dtype(layers_ids: List[np.ndarray]) -> np.dtype:
+    """Get the smallest unsigned integer type holding the 1-based indices of the layers."""
+    return np.min_scalar_type(len(layers_ids))
+
+
+def _layers_lookup_table(layers_ids: List[np.ndarray], size: int) -> np.ndarray:
+    """
+    Create a lookup table mapping region ids to 1-based layer indices.
+
+    Ids out of every layer are mapped to 0. As with successive masked assignments of the layer
+    indices, an id shared by several layers is mapped to the last of them.
+    """
+    lut = np.zeros(size, dtype=_layers_dtype(layers_ids))
+    for (index, layer_ids) in enumerate(layers_ids, 1):
+        lut[_lookup_table_indices(layer_ids, size)] = index
+
+    return lut
+
+
+def _isin_layered_volume(annotated_volume: AnnotationT, layers_ids: List[np.ndarray]) -> np.ndarray:
+    """
+    Label by 1-based layer indices an annotation which cannot index a lookup table.
+    """
+    layers = np.zeros_like(annotated_volume, dtype=_layers_dtype(layers_ids))
+    for (index, layer_ids) in enumerate(layers_ids, 1):
+        layers[_isin(annotated_volume, layer_ids)] = index
+
+    return layers
+
+
+def _label_layers(annotated_volume: AnnotationT, layers_ids: List[np.ndarray]) -> np.ndarray:
+    """
+    Label the voxels of `annotated_volume` by the 1-based indices of the layers `layers_ids`.
+
+    See :fun:`atlas_commons.utils.create_layered_volume`.
+    """
+    if not any(layer_ids.size for layer_ids in layers_ids):
+        # No voxel is labeled. Zero-filled memory is obtained without a pass over the volume.
+        return np.zeros(annotated_volume.shape, dtype=_layers_dtype(layers_ids))
+
+    size = _lookup_table_size(annotated_volume)
+    if size is None:
+        return _isin_layered_volume(annotated_volume, layers_ids)
+
+    # A single gather from the lookup table labels all the layers in one pass over the volume.
+    return _apply_lookup_table(_layers_lookup_table(layers_ids, size), annotated_volume)
+
+
 def create_layered_volume(
     annotated_volume: AnnotationT,
     region_map: voxcell.RegionMap,
@@ -198,7 +548,8 @@ def create_layered_volume(
     Returns:
         A numpy array of the same shape as the input volume, i.e., (W, H, D). Voxels are labeled by
         the 1-based indices of the layers defined in `metadata`. Voxels out of the region defined in
-        `metadata` are labeled with the 0 index.
+        `metadata` are labeled with the 0 index. The array has the smallest unsigned integer type
+        holding the layer indices, i.e., uint8 for up to 255 layers.
 
     Raises:
         AtlasBuildingErrors if `metadata` has an incorrect format.
@@ -206,22 +557,7 @@ def create_layered_volume(
 
     assert_metadata_content(metadata)
 
-    metadata_layers = metadata["layers"]
-    layers = np.zeros_like(annotated_volume, dtype=np.uint8)
-    region_ids = region_map.find(
-        metadata["region"]["query"],
-        attr=metadata["region"]["attribute"],
-        with_descendants=metadata["region"].get("with_descendants", False),
-    )
-    for (index, query) in enumerate(metadata_layers["queries"], 1):
-        layer_ids = region_map.find(
-            query,
-            attr=metadata_layers["attribute"],
-            with_descendants=metadata_layers.get("with_descendants", False),
-        )
-        layers[np.isin(annotated_volume, list(layer_ids & region_ids))] = index
-
-    return layers
+    return _label_layers(annotated_volume, _get_layers_ids(region_map, metadata))
 
 
 def get_layer_masks(
@@ -240,11 +576,111 @@ def get_layer_masks(
             for examples.
 
     Returns: dict whose keys are the regions names from `metadata` and whose values
-        are boolean masks of the corresponding regions in `annotated_volume`.
+        are boolean masks of the corresponding regions in `annotated_volume`. The masks are views
+        of a single array stacking the masks of all the layers.
     """
-    layers = create_layered_volume(annotated_volume, region_map, metadata)
+    assert_metadata_content(metadata)
 
-    return {name: layers == i for (i, name) in enumerate(metadata["layers"]["names"], 1)}
+    layers = _label_layers(annotated_volume, _get_layers_ids(region_map, metadata))
+    names = metadata["layers"]["names"]
+    indices = np.arange(1, len(names) + 1, dtype=layers.dtype).reshape((-1,) + (1,) * layers.ndim)
+    # A single broadcast comparison of the layered volume fills the masks of all the layers. It is
+    # cheaper than gathering each mask from the annotation.
+    masks = layers == indices
+
+    return dict(zip(names, masks))
+
+
+@njit(parallel=True, nogil=True, cache=True, boundscheck=False)
+def _zero_to_nan_kernel(vectors):
+    """
+    Turn in place the zero rows of a 2D array into NaN rows in a single pass.
+    """
+    for i in prange(vectors.shape[0]):  # pylint: disable=not-an-iterable
+        is_zero = True
+        for j in range(vectors.shape[1]):
+            if vectors[i, j] != 0.0:
+                is_zero = False
+                break
+        if is_zero:
+            for j in range(vectors.shape[1]):
+                vectors[i, j] = np.nan
+
+
+def _fits_vector_kernels(field: FloatArray) -> bool:
+    """
+    Tell whether the vector field kernels can process `field` in place.
+
+    The kernels process non-empty C-contiguous float32 or float64 fields, reshaped into views of
+    shape (-1, N).
+    """
+    return (
+        HAVE_NUMBA
+        and field.size > 0
+        and field.flags.c_contiguous
+        and field.dtype in (np.float32, np.float64)
+    )
+
+
+# Fast-math flags which preserve the semantics of NaN and infinite values, as NaN vectors are
+# expected in vector fields.
+_FASTMATH_FLAGS = {"nsz", "arcp", "contract", "afn", "reassoc"}
+
+
+# The input of the normalize kernel can be float32, float64, int32 or int64, writable or read-only,
+# e.g., a memory-mapped field.
+@njit(parallel=True, nogil=True, fastmath=_FASTMATH_FLAGS, cache=True, boundscheck=False)
+def _normalize_kernel(vectors, out):
+    """
+    Write in `out` the normalized rows of the 2D array `vectors` in a single pass.
+
+    Rows of zero norm are turned into NaN rows and rows with NaN components are unchanged, as in
+    `normalize`. `out` can be `vectors` itself to normalize in place. Components are converted to
+    float64 while they are read, so that the squared norms of float32 rows do not underflow and
+    the squares of integer components do not overflow.
+    """
+    for i in prange(vectors.shape[0]):  # pylint: disable=not-an-iterable
+        squared_norm = 0.0
+        for j in range(vectors.shape[1]):
+            component = np.float64(vectors[i, j])
+            squared_norm += component * component
+        if squared_norm > 0.0:
+            inverse_norm = 1.0 / math.sqrt(squared_norm)
+            for j in range(vectors.shape[1]):
+                out[i, j] = vectors[i, j] * inverse_norm
+        elif squared_norm == 0.0:  # zero rows and float64 rows whose squared norms underflow
+            for j in range(vectors.shape[1]):
+                out[i, j] = np.nan
+        else:  # rows with NaN components
+            for j in range(vectors.shape[1]):
+                out[i, j] = vectors[i, j]
+
+
+def _as_vectors(field: np.ndarray) -> np.ndarray:
+    """
+    Reshape a vector field of shape (..., N) into an array of shape (-1, N), a view if possible.
+    """
+    return field.reshape(-1, field.shape[-1])
+
+
+def _zero_vectors_mask(field: FloatArray) -> np.ndarray:
+    """
+    Get the boolean mask of the zero vectors of `field`, an array of shape (..., N).
+
+    The vector components are ORed as unsigned integers of the same width, one component at a
+    time, which is much faster than an `np.any` reduction over the short last axis. The sign bits
+    are shifted out so that -0.0 components count as zeros, which requires the native byte order.
+    """
+    if not field.dtype.isnative or field.dtype.itemsize not in (2, 4, 8) or field.shape[-1] == 0:
+        return ~np.any(field, axis=-1)
+
+    bits = field.view(f"u{field.dtype.itemsize}")
+    acc = bits[..., 0].copy()
+    for i in range(1, field.shape[-1]):
+        np.bitwise_or(acc, bits[..., i], out=acc)
+    np.left_shift(acc, 1, out=acc)
+
+    return acc == 0
 
 
 def zero_to_nan(field: FloatArray) -> None:
@@ -265,9 +701,13 @@ def zero_to_nan(field: FloatArray) -> None:
     """
     if not np.issubdtype(field.dtype, np.floating):
         raise ValueError(f"The input field must be of floating point type. Got {field.dtype}.")
-    norms = np.linalg.norm(field, axis=-1)
-    # pylint: disable=unsupported-assignment-operation
-    field[norms == 0] = np.nan
+    if _fits_vector_kernels(field):
+        _zero_to_nan_kernel(_as_vectors(field))
+        return
+
+    zero_mask = _zero_vectors_mask(field)  # cheaper than testing the nullity of the norms
+    # A masked copy broadcast over the vector components avoids boolean fancy indexing.
+    np.copyto(field, np.nan, where=zero_mask[..., np.newaxis])
 
 
 def normalize(vector_field: FloatArray):
@@ -275,18 +715,30 @@ def normalize(vector_field: FloatArray):
     Normalize in place a vector field wrt to the Euclidean norm.
 
     Zero vectors are turned into vectors with np.nan coordinates
-    silently.
+    silently. Norms are computed in float64: vectors whose norms underflow in float64 are
+    handled as zero vectors.
     NaN vectors are unchanged and warnings are kept silent.
 
     Args:
         vector_field: vector field of floating point type and of shape (..., N)
          where N is the number of vector components.
     """
-    norm = np.linalg.norm(vector_field, axis=-1)
+    if _fits_vector_kernels(vector_field):
+        # The reshaped array is a view, hence the normalization is done in place.
+        vectors = _as_vectors(vector_field)
+        _normalize_kernel(vectors, vectors)
+        return
+
+    # A single array of norms is computed and updated in place. Vectors are divided by 1 where their
+    # norms are zero or NaN, so that NaN components are left unchanged, as in the numba kernel.
+    norm_dtype = np.result_type(vector_field.dtype, np.float64)
+    norm = np.asarray(np.einsum("...i,...i->...", vector_field, vector_field, dtype=norm_dtype))
+    np.sqrt(norm, out=norm)
+    zero_mask = norm == 0  # zero vectors and vectors whose norms underflow
     with np.errstate(invalid="ignore"):  # NaNs are expected
-        norm = np.where(norm > 0, norm, 1.0)
+        np.copyto(norm, 1.0, where=~(norm > 0))
     vector_field /= norm[..., np.newaxis]
-    zero_to_nan(vector_field)
+    np.copyto(vector_field, np.nan, where=zero_mask[..., np.newaxis])
 
 
 def normalized(vector_field: NumericArray):
@@ -294,16 +746,32 @@ def normalized(vector_field: NumericArray):
     Normalize a vector field wrt to the Euclidean norm.
 
     Zero vectors are turned into vectors with np.nan coordinates
-    silently.
+    silently, as vectors whose norms underflow in float64, see `normalize`.
 
     Args:
         vector_field: vector field of floating point type and of shape (..., N)
          where N is the number of vector components.
     Return:
         normalized_:
-            vector field of unit vectors of the same shape and the same type as `vector_field`.
+            vector field of unit vectors of the same shape and the same type as `vector_field`,
+            or of type float64 if `vector_field` has integer type.
     """
-    with np.errstate(invalid="ignore"):
-        normalized_ = voxcell.math_utils.normalize(vector_field)
-        zero_to_nan(normalized_)
+    # Integer fields are normalized into float64 fields, float fields keep their type in the native
+    # byte order.
+    dtype = (
+        vector_field.dtype.newbyteorder("=")
+        if vector_field.dtype.kind == "f"
+        else np.dtype(np.float64)
+    )
+    if HAVE_NUMBA and vector_field.size > 0 and dtype in (np.float32, np.float64):
+        # int32 and int64 fields are converted by the kernel, without a float64 copy of the input.
+        kernel_dtype = vector_field.dtype if vector_field.dtype in (np.int32, np.int64) else dtype
+        vectors = np.ascontiguousarray(vector_field, dtype=kernel_dtype)
+        normalized_ = np.empty(vectors.shape, dtype=dtype)
+        _normalize_kernel(_as_vectors(vectors), _as_vectors(normalized_))
         return normalized_
+
+    normalized_ = cast("FloatArray", vector_field.astype(dtype, order="C"))
+    normalize(normalized_)
+
+    return normalized_
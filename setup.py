@@ -16,7 +16,11 @@ setup(
         "voxcell>=3.0.0",
     ],
     extras_require={
+        "numba": [
+            "numba>=0.53.0",
+        ],
         "tests": [
+            "numba>=0.53.0",
             "pytest>=4.4.0",
         ],
     },
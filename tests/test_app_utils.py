@@ -18,11 +18,54 @@ def load_nrrds(filename_list):
     return [VoxelData.load_nrrd(Path(NRRDS, filename)) for filename in filename_list]
 
 
+def test_log_args(tmp_path, monkeypatch):
+    monkeypatch.setattr(tested, "LOG_DIRECTORY", str(tmp_path))
+    L = logging.getLogger("test_log_args")
+    L.setLevel(logging.INFO)
+
+    @tested.log_args(L)
+    def fun(a, b=1):
+        pass
+
+    try:
+        fun(0)
+        fun(0, b=2)
+        assert len(L.handlers) == 1
+        assert Path(L.handlers[0].baseFilename) == tmp_path / "fun.log"
+        L.handlers[0].flush()
+        lines = (tmp_path / "fun.log").read_text().splitlines()
+        assert len(lines) == 2
+        assert lines[0].endswith("fun args:[a:0, b:b=1]")
+        assert lines[1].endswith("fun args:[a:0, b:2]")
+    finally:
+        for handler in L.handlers[:]:
+            handler.close()
+            L.removeHandler(handler)
+
+
+def test_ensure_list():
+    value = [1, 2]
+    assert tested.ensure_list(value) is value
+    assert tested.ensure_list((1, 2)) == [1, 2]
+    assert tested.ensure_list(x for x in (1, 2)) == [1, 2]
+    assert tested.ensure_list("abc") == ["abc"]
+    assert tested.ensure_list({"a": 1}) == [{"a": 1}]
+    assert tested.ensure_list(1) == [1]
+
+
 def test_assert_meta_properties_all_same():
     atlases = load_nrrds(["1.nrrd", "1.nrrd"])
     tested.assert_meta_properties(atlases)
 
 
+@pt.mark.parametrize("filename_list", [[], ["1.nrrd"]])
+def test_assert_properties_fewer_than_two_atlases(filename_list):
+    atlases = load_nrrds(filename_list)
+    tested.assert_properties(atlases)
+    tested.assert_properties(tuple(atlases))
+    tested.assert_meta_properties(atlases)
+
+
 def test_assert_meta_properties_numpy_shape_mismatch():
     atlases = load_nrrds(["1.nrrd", "1_direction_vectors.nrrd"])
     tested.assert_meta_properties(atlases)
@@ -69,6 +112,12 @@ def test_assert_properties_3():
         tested.assert_properties(atlases)
 
 
+def test_assert_properties_numpy_shape_mismatch():
+    atlases = load_nrrds(["1.nrrd", "1_direction_vectors.nrrd"])
+    with pt.raises(AtlasCommonsError):
+        tested.assert_properties(atlases)
+
+
 def test_common_atlas_options():
     @click.command()
     @tested.common_atlas_options
@@ -107,3 +156,28 @@ def test_verbose_option():
     runner = CliRunner()
     result = runner.invoke(fun, ["-vv"])
     assert result.exit_code == 0, str(result.output)
+
+
+def test_verbose_option_log_output_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(tested, "LOG_DIRECTORY", tested.LOG_DIRECTORY)
+
+    @click.group()
+    def app():
+        pass
+
+    @app.command()
+    @tested.verbose_option
+    def fun_1(verbose):
+        assert verbose == 1, verbose
+
+    @app.command()
+    @tested.verbose_option
+    def fun_2(verbose):
+        assert verbose == 0, verbose
+
+    runner = CliRunner()
+    result = runner.invoke(app, ["fun-1", "-v", "--log-output-path", str(tmp_path)])
+    assert result.exit_code == 0, str(result.output)
+    assert tested.LOG_DIRECTORY == str(tmp_path)
+    result = runner.invoke(app, ["fun-2"])
+    assert result.exit_code == 0, str(result.output)
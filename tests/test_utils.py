@@ -1,4 +1,8 @@
 """test utils"""
+import json
+import subprocess
+import sys
+import weakref
 from pathlib import Path
 
 TEST_PATH = Path(Path(__file__).parent)
@@ -12,41 +16,188 @@ import atlas_commons.utils as tested
 from atlas_commons.exceptions import AtlasCommonsError
 
 
-@pytest.fixture
-def region_map_1():
-    return RegionMap.load_json(str(Path(TEST_PATH, "1.json")))
+@pytest.fixture(
+    params=[pytest.param(True, id="numba")] * tested.HAVE_NUMBA + [pytest.param(False, id="numpy")],
+)
+def have_numba(request, monkeypatch):
+    """Run a test with the numba kernels if numba is installed, and with numpy
 
+    The results of RegionMap.find are not shared between the runs, so that each run queries the
+    module-scoped RegionMaps with its own implementation.
+    """
+    monkeypatch.setattr(tested, "HAVE_NUMBA", request.param)
+    monkeypatch.setattr(tested, "_FIND_CACHE", weakref.WeakKeyDictionary())
 
-@pytest.fixture
+
+# Applied to the tests of the functions which have both numba and numpy implementations
+with_and_without_numba = pytest.mark.usefixtures("have_numba")
+
+
+def read_only(array):
+    """Protect the arrays of the fixtures shared by all the tests of the module"""
+    array.setflags(write=False)
+    return array
+
+
+@pytest.fixture(scope="module")
+def hierarchy_1():
+    """The hierarchy of 1.json, parsed once; RegionMap.from_dict works on a copy of it"""
+    (hierarchy,) = json.loads(Path(TEST_PATH, "1.json").read_bytes())["msg"]
+    return hierarchy
+
+
+@pytest.fixture(scope="module")
+def region_map_1(hierarchy_1):
+    return RegionMap.from_dict(hierarchy_1)
+
+
+@pytest.fixture(scope="module")
 def annotation():
-    return np.arange(27).reshape((3, 3, 3))
+    return read_only(np.arange(27).reshape((3, 3, 3)))
 
 
-@pytest.fixture
+def mask_from_positions(shape, positions):
+    """Create a boolean mask of the given shape which is True at the given positions only"""
+    mask = np.zeros(shape, dtype=bool)
+    mask[tuple(np.transpose(positions))] = True
+    return mask
+
+
+@pytest.fixture(scope="module")
 def expected_region_mask():
-    expected = np.zeros((3, 3, 3), dtype=bool)
-    expected[0, 0, 2] = True  # label 2, "SSp-m6b"
-    expected[1, 0, 0] = True  # label 9, "SSp-tr6a"
-    expected[2, 1, 1] = True  # label 22, "SSp-tr6a"
+    # Labels 2, "SSp-m6b", 9, "SSp-tr6a", and 22, "SSp-tr6a"
+    return read_only(mask_from_positions((3, 3, 3), [(0, 0, 2), (1, 0, 0), (2, 1, 1)]))
+
+
+def test_voxcell_is_not_imported():
+    code = "import sys, atlas_commons.utils; assert 'voxcell' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+@with_and_without_numba
+@pytest.mark.parametrize(
+    "get_mask",
+    [
+        pytest.param(
+            lambda *args: tested.query_region_mask(
+                {"query": "Isocortex", "attribute": "acronym", "with_descendants": True}, *args
+            ),
+            id="query_region_mask",
+        ),
+        pytest.param(
+            lambda *args: tested.get_region_mask("Isocortex", *args), id="get_region_mask"
+        ),
+    ],
+)
+def test_region_mask(get_mask, region_map_1, annotation, expected_region_mask):
+    mask = get_mask(annotation, region_map_1)
+    npt.assert_array_equal(mask, expected_region_mask)
 
-    return expected
 
+@with_and_without_numba
+def test_get_region_mask_few_ids(region_map_1, annotation):
+    mask = tested.get_region_mask("SSp-m6b", annotation, region_map_1)
+    npt.assert_array_equal(mask, mask_from_positions((3, 3, 3), [(0, 0, 2)]))  # label 2
 
-def test_query_region_mask(region_map_1, annotation, expected_region_mask):
+
+@with_and_without_numba
+def test_query_region_mask_negative_labels(region_map_1, annotation, expected_region_mask):
     region = {
         "query": "Isocortex",
         "attribute": "acronym",
         "with_descendants": True,
     }
+    annotation = annotation.copy()
+    annotation[0, 0, 0] = -1
     mask = tested.query_region_mask(region, annotation, region_map_1)
     npt.assert_array_equal(mask, expected_region_mask)
 
 
-def test_get_region_mask(region_map_1, annotation, expected_region_mask):
+@with_and_without_numba
+def test_query_region_mask_bit_packed(monkeypatch, region_map_1, annotation, expected_region_mask):
+    monkeypatch.setattr(tested, "_MAX_DENSE_MASK_LOOKUP_TABLE_SIZE", 0)
     mask = tested.get_region_mask("Isocortex", annotation, region_map_1)
     npt.assert_array_equal(mask, expected_region_mask)
 
 
+@with_and_without_numba
+def test_gather_region_mask_bit_packed(monkeypatch):
+    monkeypatch.setattr(tested, "_MAX_DENSE_MASK_LOOKUP_TABLE_SIZE", 0)
+    annotation = np.arange(20, dtype=np.uint16).reshape((4, 5))
+    ids = np.array([1, 3, 4, 7, 8, 17, 25], dtype=np.int64)  # several ids per byte
+    mask = tested._gather_region_mask(ids, 20, annotation)
+    npt.assert_array_equal(mask, np.isin(annotation, ids))
+
+
+@with_and_without_numba
+@pytest.mark.parametrize(
+    "max_dense_size", [pytest.param(1 << 20, id="dense"), pytest.param(0, id="bits")]
+)
+def test_query_region_mask_big_endian(
+    monkeypatch, max_dense_size, region_map_1, annotation, expected_region_mask
+):
+    monkeypatch.setattr(tested, "_MAX_DENSE_MASK_LOOKUP_TABLE_SIZE", max_dense_size)
+    mask = tested.get_region_mask("Isocortex", annotation.astype(">u4"), region_map_1)
+    npt.assert_array_equal(mask, expected_region_mask)
+
+
+@with_and_without_numba
+def test_find_is_cached(monkeypatch, hierarchy_1, annotation, expected_region_mask):
+    region_map = RegionMap.from_dict(hierarchy_1)  # not cached yet
+    calls = []
+    find = region_map.find
+
+    def counting_find(*args, **kwargs):
+        calls.append(args)
+        return find(*args, **kwargs)
+
+    monkeypatch.setattr(region_map, "find", counting_find)
+    for _ in range(2):
+        mask = tested.get_region_mask("Isocortex", annotation, region_map)
+        npt.assert_array_equal(mask, expected_region_mask)
+    assert len(calls) == 1
+
+
+@with_and_without_numba
+@pytest.mark.parametrize(
+    "query,attribute",
+    [("Isocortex", "acronym"), ("@.*6b$", "acronym"), ("@^Somatosensory", "name"), (997, "id")],
+)
+def test_find_with_descendants(query, attribute, hierarchy_1):
+    region_map = RegionMap.from_dict(hierarchy_1)  # not cached yet
+    ids = tested._find(region_map, query, attribute, with_descendants=True)
+    assert len(ids) == len(set(ids))
+    assert set(ids) == region_map.find(query, attribute, with_descendants=True)
+
+
+@with_and_without_numba
+@pytest.mark.parametrize(
+    "queries",
+    [
+        ["@.*1$", "@.*2/3$", "@.*5$", "@.*1$"],
+        ["@^SS", "@b$"],  # overlapping matches
+        ["@(L)1$", "@.*5$"],  # groups cannot be combined
+        ["@^SS", "@(?x) b $"],  # global inline flags cannot be combined
+        ["Isocortex", "@.*5$"],
+    ],
+)
+@pytest.mark.parametrize("with_descendants", [False, True])
+def test_find_all(queries, with_descendants, hierarchy_1):
+    region_map = RegionMap.from_dict(hierarchy_1)  # not cached yet
+    actual = tested._find_all(region_map, queries, "acronym", with_descendants=with_descendants)
+    assert len(actual) == len(queries)
+    for ids, query in zip(actual, queries):
+        assert len(ids) == len(set(ids))
+        assert set(ids) == region_map.find(query, "acronym", with_descendants=with_descendants)
+
+
+@pytest.mark.parametrize(
+    "queries", [["@^SS", "@(?x) b $"], ["@(?i)^ss", "@b$"], ["@(?u)^SS", "@b$"]]
+)
+def test_match_regexes_inline_flags(queries, region_map_1):
+    assert tested._match_regexes(region_map_1, queries, "acronym") is None
+
+
 def test_split_into_halves():
     volume = np.array(
         [
@@ -154,28 +305,78 @@ def get_metadata(region_fullname="Isocortex"):
     }
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def region_map():
     return RegionMap.from_dict(get_hierarchy_excerpt())
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def annotated_volume():
-    return np.array([[[107, 107, 107, 12993, 219, 219, 219, 299, 299, 299]]], dtype=np.uint32)
+    return read_only(
+        np.array([[[107, 107, 107, 12993, 219, 219, 219, 299, 299, 299]]], dtype=np.uint32)
+    )
 
 
-def test_create_layered_volume(region_map, annotated_volume):
-    metadata = get_metadata("Isocortex")
-    expected_layers_volume = np.array([[[1, 1, 1, 1, 2, 2, 2, 3, 3, 3]]], dtype=np.uint8)
+@with_and_without_numba
+@pytest.mark.parametrize(
+    "region_fullname,expected_layers",
+    [
+        ("Isocortex", [1, 1, 1, 1, 2, 2, 2, 3, 3, 3]),
+        ("Somatomotor areas", [1, 1, 1, 0, 2, 2, 2, 3, 3, 3]),
+    ],
+)
+def test_create_layered_volume(region_fullname, expected_layers, region_map, annotated_volume):
+    metadata = get_metadata(region_fullname)
+    expected_layers_volume = np.array([[expected_layers]], dtype=np.uint8)
     actual = tested.create_layered_volume(annotated_volume, region_map, metadata)
     npt.assert_array_equal(expected_layers_volume, actual)
 
-    metadata = get_metadata("Somatomotor areas")
-    expected_layers_volume = np.array([[[1, 1, 1, 0, 2, 2, 2, 3, 3, 3]]], dtype=np.uint8)
+
+@with_and_without_numba
+def test_create_layered_volume_negative_labels(region_map, annotated_volume):
+    annotated_volume = annotated_volume.astype(np.int64)
+    annotated_volume[0, 0, 0] = -1
+    metadata = get_metadata("Isocortex")
+    expected_layers_volume = np.array([[[0, 1, 1, 1, 2, 2, 2, 3, 3, 3]]], dtype=np.uint8)
     actual = tested.create_layered_volume(annotated_volume, region_map, metadata)
     npt.assert_array_equal(expected_layers_volume, actual)
 
 
+@with_and_without_numba
+def test_create_layered_volume_big_endian(region_map, annotated_volume):
+    metadata = get_metadata("Isocortex")
+    expected_layers_volume = np.array([[[1, 1, 1, 1, 2, 2, 2, 3, 3, 3]]], dtype=np.uint8)
+    actual = tested.create_layered_volume(annotated_volume.astype(">u4"), region_map, metadata)
+    npt.assert_array_equal(expected_layers_volume, actual)
+
+
+@with_and_without_numba
+def test_create_layered_volume_empty_layers(region_map, annotated_volume):
+    metadata = get_metadata("Isocortex")
+    metadata["layers"]["queries"] = ["@^nowhere$"] * 3
+    actual = tested.create_layered_volume(annotated_volume, region_map, metadata)
+    assert actual.dtype == np.uint8
+    npt.assert_array_equal(actual, np.zeros_like(annotated_volume))
+
+
+@with_and_without_numba
+def test_create_layered_volume_many_layers(region_map_1):
+    ids = sorted(region_map_1.find("root", "acronym", with_descendants=True))[:300]
+    metadata = {
+        "region": {
+            "name": "root",
+            "query": "root",
+            "attribute": "acronym",
+            "with_descendants": True,
+        },
+        "layers": {"names": [str(id_) for id_ in ids], "queries": ids, "attribute": "id"},
+    }
+    actual = tested.create_layered_volume(np.array([ids]), region_map_1, metadata)
+    assert actual.dtype == np.uint16
+    npt.assert_array_equal(actual, [np.arange(1, 301)])
+
+
+@with_and_without_numba
 def test_get_layer_masks(region_map, annotated_volume):
     metadata = get_metadata("Isocortex")
     expected_layer_masks = {
@@ -188,6 +389,19 @@ def test_get_layer_masks(region_map, annotated_volume):
         npt.assert_array_equal(expected_layer_masks[layer_name], actual[layer_name])
 
 
+@with_and_without_numba
+def test_get_layer_masks_restricted_region(region_map, annotated_volume):
+    metadata = get_metadata("Somatomotor areas")
+    expected_layer_masks = {
+        "layer_1": np.array([[[1, 1, 1, 0, 0, 0, 0, 0, 0, 0]]], dtype=bool),
+        "layer_23": np.array([[[0, 0, 0, 0, 1, 1, 1, 0, 0, 0]]], dtype=bool),
+        "layer_5": np.array([[[0, 0, 0, 0, 0, 0, 0, 1, 1, 1]]], dtype=bool),
+    }
+    actual = tested.get_layer_masks(annotated_volume, region_map, metadata)
+    for layer_name in expected_layer_masks:
+        npt.assert_array_equal(expected_layer_masks[layer_name], actual[layer_name])
+
+
 def test_assert_metadata_content(region_map, annotated_volume):
     with pytest.raises(AtlasCommonsError):
         metadata = get_metadata("Isocortex")
@@ -215,6 +429,7 @@ def test_assert_metadata_content(region_map, annotated_volume):
         tested.assert_metadata_content(metadata)
 
 
+@with_and_without_numba
 def test_zero_to_nan():
     # 3D unit vectors
     field = np.ones((2, 2, 2, 3), dtype=np.float32)
@@ -242,17 +457,135 @@ def test_zero_to_nan():
         tested.zero_to_nan(field)
 
 
+@with_and_without_numba
+@pytest.mark.parametrize(
+    "dtype",
+    [np.float16, np.float32, np.float64, np.longdouble, np.dtype(np.float32).newbyteorder()],
+)
+def test_zero_to_nan_signed_zeros(dtype):
+    field = np.array([[0.0, -0.0, 0.0], [-0.0, 1.0, 0.0], [0.0, 0.0, np.nan], [-0.0, -0.0, -0.0]])
+    field = field.astype(dtype)
+    expected = np.array([[np.nan] * 3, [-0.0, 1.0, 0.0], [0.0, 0.0, np.nan], [np.nan] * 3])
+    tested.zero_to_nan(field)
+    npt.assert_array_equal(field, expected)
+
+    # Non-contiguous vector components
+    field = np.zeros((2, 6), dtype=dtype)[:, ::2]
+    field[1, 1] = 2.0
+    tested.zero_to_nan(field)
+    npt.assert_array_equal(field, [[np.nan] * 3, [0.0, 2.0, 0.0]])
+
+
+@with_and_without_numba
 def test_normalized():
     # A 3D vector field of integer type
     vector_field = np.ones((2, 2, 2, 3), dtype=np.int32)
     normalized = tested.normalized(vector_field)
+    assert normalized.dtype == np.float64
     npt.assert_array_almost_equal(normalized, np.full((2, 2, 2, 3), 1.0 / np.sqrt(3.0)))
     # A 4D vector field with some zero vectors
     vector_field = np.zeros((2, 2, 2, 4), dtype=np.float32)
     vector_field[0, 0, 0] = np.array([1, 1.0, 0.0, 0.0])
     vector_field[1, 1, 1] = np.array([0, 1, 1, 1])
     normalized = tested.normalized(vector_field)
+    assert normalized.dtype == np.float32
     expected = np.full(normalized.shape, np.nan)
     expected[0, 0, 0] = np.array([1.0, 1.0, 0.0, 0.0]) / np.sqrt(2.0)
     expected[1, 1, 1] = np.array([0.0, 1.0, 1.0, 1.0]) / np.sqrt(3.0)
     npt.assert_array_almost_equal(normalized, expected)
+    # The input field is left unchanged
+    npt.assert_array_equal(vector_field[0, 0, 0], [1.0, 1.0, 0.0, 0.0])
+
+
+@with_and_without_numba
+@pytest.mark.parametrize("dtype", [">f4", ">f8", ">i4"])
+def test_normalized_big_endian_field(dtype):
+    normalized = tested.normalized(np.array([[3, 4], [0, 0]], dtype=dtype))
+    assert normalized.dtype.isnative
+    assert normalized.dtype.kind == "f"
+    npt.assert_array_almost_equal(normalized, [[0.6, 0.8], [np.nan] * 2])
+
+
+@with_and_without_numba
+@pytest.mark.parametrize("dtype", [np.float32, np.float64, np.int32, np.int64])
+def test_normalized_read_only_field(dtype):
+    vector_field = read_only(np.array([[3, 4], [0, 0]], dtype=dtype))
+    normalized = tested.normalized(vector_field)
+    npt.assert_array_almost_equal(normalized, [[0.6, 0.8], [np.nan] * 2])
+
+
+@with_and_without_numba
+@pytest.mark.parametrize("dtype", [np.uint8, np.int32, np.int64])
+def test_normalized_integer_field(dtype):
+    vector_field = np.array([[[3, 4], [0, 0]], [[0, 5], [7, 0]]], dtype=dtype)
+    normalized = tested.normalized(vector_field)
+    assert normalized.dtype == np.float64
+    npt.assert_array_almost_equal(normalized, [[[0.6, 0.8], [np.nan] * 2], [[0, 1], [1, 0]]])
+
+    # The squares of the components do not overflow
+    if np.iinfo(dtype).max > 1 << 32:
+        normalized = tested.normalized(np.array([[3 << 40, 4 << 40]], dtype=dtype))
+        npt.assert_array_almost_equal(normalized, [[0.6, 0.8]])
+
+
+@with_and_without_numba
+def test_normalize():
+    vector_field = np.zeros((2, 2, 2, 3), dtype=np.float32)
+    vector_field[0, 0, 0] = [1.0, 1.0, 1.0]
+    vector_field[1, 0, 0] = [0.0, 3.0, 4.0]
+    vector_field[1, 1, 1] = np.nan
+    expected = np.full(vector_field.shape, np.nan)
+    expected[0, 0, 0] = np.full(3, 1.0 / np.sqrt(3.0))
+    expected[1, 0, 0] = [0.0, 0.6, 0.8]
+    tested.normalize(vector_field)
+    npt.assert_array_almost_equal(vector_field, expected)
+
+    # Non-contiguous vector field
+    vector_field = np.zeros((2, 2, 2, 4), dtype=np.float64)
+    vector_field[0, 1, 0] = [0.0, 2.0, 2.0, 0.0]
+    vector_field = vector_field[..., ::2]
+    expected = np.full(vector_field.shape, np.nan)
+    expected[0, 1, 0] = [0.0, 1.0]
+    tested.normalize(vector_field)
+    npt.assert_array_almost_equal(vector_field, expected)
+
+    # Vectors whose norms underflow are turned into NaN vectors, as zero vectors
+    vector_field = np.zeros((2, 6), dtype=np.float64)[:, ::2]
+    vector_field[0] = [1e-200, 0.0, 0.0]
+    vector_field[1] = [0.0, 3.0, 4.0]
+    tested.normalize(vector_field)
+    npt.assert_array_almost_equal(vector_field, [[np.nan] * 3, [0.0, 0.6, 0.8]])
+
+
+@with_and_without_numba
+@pytest.mark.parametrize("step", [pytest.param(1, id="contiguous"), pytest.param(2, id="strided")])
+def test_normalize_partial_nan_vectors(step):
+    vector_field = np.zeros((3, 3 * step), dtype=np.float64)[:, ::step]
+    vector_field[...] = [[np.nan, 1.0, 0.0], [0.0, 0.0, 0.0], [0.0, 3.0, 4.0]]
+    tested.normalize(vector_field)
+    npt.assert_array_almost_equal(vector_field, [[np.nan, 1.0, 0.0], [np.nan] * 3, [0.0, 0.6, 0.8]])
+
+
+@with_and_without_numba
+@pytest.mark.parametrize("step", [pytest.param(1, id="contiguous"), pytest.param(2, id="strided")])
+def test_normalize_tiny_vectors(step):
+    # Norms are computed in float64: tiny float32 vectors are normalized
+    vector_field = np.zeros((2, 3 * step), dtype=np.float32)[:, ::step]
+    vector_field[...] = [[1e-30, 0.0, 0.0], [0.0, 3e-30, 4e-30]]
+    tested.normalize(vector_field)
+    npt.assert_array_almost_equal(vector_field, [[1.0, 0.0, 0.0], [0.0, 0.6, 0.8]])
+    npt.assert_array_almost_equal(tested.normalized(np.float32([[0.0, 1e-30]])), [[0.0, 1.0]])
+
+    # float64 vectors whose norms underflow are turned into NaN vectors
+    vector_field = np.zeros((2, 3 * step), dtype=np.float64)[:, ::step]
+    vector_field[...] = [[1e-200, 0.0, 0.0], [0.0, 3e-200, 4e-200]]
+    tested.normalize(vector_field)
+    npt.assert_array_equal(vector_field, np.full((2, 3), np.nan))
+    npt.assert_array_equal(tested.normalized(np.float64([[0.0, 1e-200]])), [[np.nan] * 2])
+
+
+@with_and_without_numba
+def test_normalize_single_vector():
+    vector = np.array([3.0, 4.0])
+    tested.normalize(vector)
+    npt.assert_array_almost_equal(vector, [0.6, 0.8])